@@ -1,15 +1,30 @@
 import streamlit as st
 import os
+import sys
+import asyncio
+
+# POSIX 환경에서는 libuv 기반 uvloop로 asyncio 루프를 교체
+# (STT/모더레이션/임베딩/DALL-E 동시 호출 시 루프 오버헤드 감소, Windows 미지원)
+if sys.platform != "win32":
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass # uvloop 미설치 시 기본 이벤트 루프 사용
 from PIL import Image
 from services import stt_service, dream_analyzer_service, image_generator_service, moderation_service, report_generator_service
 from st_audiorec import st_audiorec
-import base64
-import tempfile
+import io
 import re
+import atexit
+import functools
+import hashlib
+import httpx
 
 # RAG(Retrieval-Augmented Generation) 기능을 위한 임포트
-from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import FAISS
+from core.indexing_service import load_vector_store_mmap, create_retrieval_embeddings
+# 모든 비동기 파이프라인을 하나의 상주 루프에서 실행 (공유 커넥션 풀의 루프 바인딩 보존)
+from core.async_runner import get_loop, run_sync
 
 # --- 1. 페이지 설정 (가장 먼저 실행되어야 함) ---
 st.set_page_config(
@@ -27,15 +42,41 @@ def initialize_services():
         st.error("OPENAI_API_KEY 환경 변수가 설정되지 않았습니다.")
         st.stop()
     try:
-        embeddings = OpenAIEmbeddings(api_key=openai_api_key)
-        vector_store = FAISS.load_local("faiss_index", embeddings, allow_dangerous_deserialization=True)
+        # 검색용 임베딩은 로컬 MiniLM 모델 사용 (쿼리당 API 왕복 제거, 인제스트와 동일 모델)
+        embeddings = create_retrieval_embeddings()
+        # 인덱스를 mmap으로 로드하여 워커 콜드 스타트 시 전체 역직렬화 비용 제거
+        vector_store = load_vector_store_mmap(embeddings, "faiss_index")
         retriever = vector_store.as_retriever()
-        
-        _stt = stt_service.STTService(api_key=openai_api_key)
-        _analyzer = dream_analyzer_service.DreamAnalyzerService(api_key=openai_api_key)
-        _img_gen = image_generator_service.ImageGeneratorService(api_key=openai_api_key)
-        _moderator = moderation_service.ModerationService(api_key=openai_api_key)
-        _report_gen = report_generator_service.ReportGeneratorService(api_key=openai_api_key, retriever=retriever)
+
+        # 모든 서비스가 공유하는 HTTP/2 커넥션 풀
+        # (서비스별 개별 풀 대신 하나로 TLS/TCP 핸드셰이크 비용을 분산)
+        pool_limits = httpx.Limits(max_keepalive_connections=64, max_connections=128)
+        shared_http = httpx.Client(http2=True, limits=pool_limits, timeout=120.0)
+        shared_ahttp = httpx.AsyncClient(http2=True, limits=pool_limits, timeout=120.0)
+
+        # 프로세스 종료 시 공유 풀을 정리하여 커넥션을 정상적으로 닫음
+        # (st.cache_resource에는 해제 훅이 없으므로 atexit으로 등록)
+        # atexit은 LIFO라 루프 정지 핸들러보다 _close_http_pools가 먼저 실행되어야 함
+        # → 여기서 get_loop()를 먼저 호출해 루프 정지 핸들러를 앞서 등록시킴
+        get_loop()
+
+        def _close_http_pools():
+            try:
+                shared_http.close()
+            except Exception:
+                pass # 종료 경로에서는 정리 실패를 무시
+            try:
+                # 비동기 풀은 커넥션이 묶여 있는 공유 루프 위에서 닫아야 함
+                run_sync(shared_ahttp.aclose(), timeout=5.0)
+            except Exception:
+                pass # 이미 닫혔거나 루프 종료 후인 경우 무시
+        atexit.register(_close_http_pools)
+
+        _stt = stt_service.STTService(api_key=openai_api_key, http_client=shared_http, http_async_client=shared_ahttp)
+        _analyzer = dream_analyzer_service.DreamAnalyzerService(api_key=openai_api_key, http_client=shared_http, http_async_client=shared_ahttp)
+        _img_gen = image_generator_service.ImageGeneratorService(api_key=openai_api_key, http_client=shared_http, http_async_client=shared_ahttp)
+        _moderator = moderation_service.ModerationService(api_key=openai_api_key, http_client=shared_http, http_async_client=shared_ahttp)
+        _report_gen = report_generator_service.ReportGeneratorService(api_key=openai_api_key, retriever=retriever, http_client=shared_http, http_async_client=shared_ahttp, embeddings=embeddings)
         return _stt, _analyzer, _img_gen, _moderator, _report_gen
     except Exception as e:
         st.error(f"RAG 시스템(faiss_index) 초기화 중 오류: {e}")
@@ -43,10 +84,12 @@ def initialize_services():
         st.stop()
 
 # --- 3. 헬퍼 함수 정의 ---
-def get_base64_image(image_path):
+@st.cache_data(show_spinner=False)
+def load_image_bytes(image_path):
+    # 이미지 파일 바이트를 캐싱하여 rerun마다의 존재 확인/읽기 syscall 제거
     try:
         with open(image_path, "rb") as img_file:
-            return base64.b64encode(img_file.read()).decode()
+            return img_file.read()
     except FileNotFoundError:
         return None
 
@@ -59,15 +102,51 @@ def translate_image_error_message(raw_error_message: str) -> str:
         return "OpenAI API 키가 유효하지 않습니다."
     return "알 수 없는 오류로 이미지 생성에 실패했습니다."
 
+@functools.lru_cache(maxsize=64)
+def _compile_highlight_pattern(sorted_keywords: tuple) -> "re.Pattern":
+    # 키워드들을 하나의 교대(alternation) 패턴으로 합쳐 한 번에 컴파일.
+    # 같은 세션 상태로 반복 rerun될 때 재컴파일을 건너뛰도록 lru_cache로 메모이즈.
+    return re.compile("|".join(re.escape(k) for k in sorted_keywords), re.IGNORECASE)
+
 def highlight_keywords(text: str, keywords: list, color: str = "red") -> str:
     if not keywords or not text: return text
-    sorted_keywords = sorted(list(set(keywords)), key=len, reverse=True)
-    highlighted_text = text
-    for keyword in sorted_keywords:
-        if not keyword.strip(): continue
-        pattern = re.compile(re.escape(keyword), re.IGNORECASE)
-        highlighted_text = pattern.sub(f"<span style='color:{color}; font-weight:bold;'>{keyword}</span>", highlighted_text)
-    return highlighted_text
+    # 긴 키워드가 먼저 매칭되도록 길이 내림차순 정렬 (re는 같은 위치에서 앞선 분기를 선택)
+    sorted_keywords = tuple(sorted({k for k in keywords if k.strip()}, key=len, reverse=True))
+    if not sorted_keywords: return text
+    # 합쳐진 패턴으로 전체 텍스트를 한 번만 스캔하며 치환
+    pattern = _compile_highlight_pattern(sorted_keywords)
+    return pattern.sub(lambda m: f"<span style='color:{color}; font-weight:bold;'>{m.group(0)}</span>", text)
+
+def content_hash(data) -> str:
+    # 내용 기반 캐시 키 생성. 암호학적 강도가 필요 없으므로 SHA-2보다 빠른 BLAKE2 사용
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+@st.cache_data(show_spinner=False)
+def cached_process_audio(audio_hash: str, _audio_bytes: bytes):
+    # 같은 오디오 내용(해시 동일)이면 전체 파이프라인을 건너뛰고 캐시 결과 반환.
+    # _audio_bytes는 언더스코어 접두사로 Streamlit의 인자 해싱에서 제외 (키는 audio_hash)
+    async def pipeline():
+        # 업로드 전 Opus 16kHz 모노로 재인코딩 (전송량 10~50배 축소, CPU 작업은 스레드로)
+        upload_bytes, upload_name = await asyncio.to_thread(_stt.compress_audio, _audio_bytes)
+        # 이미 RAM에 있는 오디오를 임시 파일 없이 비동기 업로드로 변환
+        text = await _stt.atranscribe_audio(io.BytesIO(upload_bytes), file_name=upload_name)
+        # 변환이 끝나는 즉시 안전성 검사와 RAG 컨텍스트 검색을 태스크로 스케줄 (병렬 I/O)
+        safety_task = asyncio.create_task(_moderator.acheck_text_safety(text))
+        context_task = asyncio.create_task(_report_gen.aretrieve_context(text))
+        # 결과가 필요한 시점에만 await
+        return text, await safety_task, await context_task
+    # 공유 루프에서 실행 (asyncio.run으로 루프를 새로 만들면 공유 풀의 커넥션이 끊김)
+    text, safety_result, rag_context = run_sync(pipeline())
+    # 서비스들은 일시적 실패를 오류 문자열/딕셔너리로 반환하므로, 그대로 반환하면
+    # 실패가 이 오디오 해시의 '결과'로 영구 캐시된다. 예외로 전환하면
+    # st.cache_data가 캐시하지 않아 같은 녹음을 다시 제출해 재시도할 수 있음
+    if text.startswith("오류:") or "오류가 발생했습니다" in text or text == "오디오 파일을 찾을 수 없습니다.":
+        raise RuntimeError(f"음성 변환 실패: {text}")
+    if safety_result.get("details", {}).get("error"):
+        raise RuntimeError(f"안전성 검사 실패: {safety_result['text']}")
+    return text, safety_result, rag_context
 
 # --- 4. 메인 애플리케이션 실행 ---
 
@@ -77,26 +156,31 @@ _stt, _analyzer, _img_gen, _moderator, _report_gen = initialize_services()
 # UI 중앙 정렬 컬럼
 col_left, col_center, col_right = st.columns([1, 2, 1])
 with col_center:
-    # 로고 및 타이틀
+    # 로고 및 타이틀 (st.image는 미디어를 URL로 서빙하므로 rerun마다 base64 인라인 전송 없음)
     logo_path = os.path.join("user_data/image", "보여dream로고 투명.png")
-    logo_base64 = get_base64_image(logo_path)
-    if logo_base64:
-        st.markdown(f"""<div style="display: flex; align-items: center; justify-content: center; margin-bottom: 1rem;"><img src="data:image/png;base64,{logo_base64}" width="120" style="margin-right: 20px;"/><h1 style="margin: 0; white-space: nowrap; font-size: 3em;">보여dream 🌙</h1></div>""", unsafe_allow_html=True)
+    logo_bytes = load_image_bytes(logo_path)
+    if logo_bytes:
+        logo_col, title_col = st.columns([0.2, 0.8])
+        with logo_col:
+            st.image(logo_bytes, width=120)
+        with title_col:
+            st.markdown("<h1 style='margin: 0; white-space: nowrap; font-size: 3em;'>보여dream 🌙</h1>", unsafe_allow_html=True)
     else:
         st.title("보여dream 🌙")
 
     # 챗봇 이미지와 안내문구
     navimong_path = os.path.join("user_data/image", "나비몽 챗봇.png")
-    if os.path.exists(navimong_path):
+    navimong_bytes = load_image_bytes(navimong_path)
+    if navimong_bytes:
         img_col, txt_col = st.columns([0.15, 0.85])
-        with img_col: st.image(navimong_path, width=150)
+        with img_col: st.image(navimong_bytes, width=150)
         with txt_col: st.markdown("<h3 style='margin-top: 15px;'>악몽을 녹음하거나 파일을 업로드해 주세요.</h3>", unsafe_allow_html=True)
     else:
         st.write("악몽을 녹음하거나 파일을 업로드해 주세요.")
     st.markdown("---")
 
     # 세션 상태 초기화 로직
-    session_defaults = {"dream_text": "", "original_dream_text": "", "analysis_started": False, "audio_processed": False, "dream_report": None, "nightmare_prompt": "", "reconstructed_prompt": "", "transformation_summary": "", "keyword_mappings": [], "nightmare_image_url": "", "reconstructed_image_url": "", "nightmare_keywords": []}
+    session_defaults = {"dream_text": "", "original_dream_text": "", "analysis_started": False, "audio_processed": False, "dream_report": None, "rag_context": "", "nightmare_prompt": "", "reconstructed_prompt": "", "transformation_summary": "", "keyword_mappings": [], "nightmare_image_url": "", "reconstructed_image_url": "", "nightmare_keywords": []}
     for key, value in session_defaults.items():
         if key not in st.session_state:
             st.session_state[key] = value
@@ -120,25 +204,24 @@ with col_center:
     # 오디오 처리 로직
     if audio_bytes and not st.session_state.audio_processed:
         initialize_session_state()
-        audio_path = None
-        try:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as temp_file:
-                temp_file.write(audio_bytes)
-                audio_path = temp_file.name
-            with st.spinner("음성을 텍스트로 변환하고 안전성 검사 중..."):
-                transcribed_text = _stt.transcribe_audio(audio_path)
+        with st.spinner("음성을 텍스트로 변환하고 안전성 검사 중..."):
+            try:
+                # 오디오 내용 해시를 캐시 키로 사용 → 같은 녹음/파일 재제출 시 전체 파이프라인 생략.
+                # STT 완료 직후 안전성 검사와 컨텍스트 검색이 하나의 이벤트 루프에서 이어짐
+                transcribed_text, safety_result, rag_context = cached_process_audio(content_hash(audio_bytes), audio_bytes)
                 st.session_state.original_dream_text = transcribed_text
-                safety_result = _moderator.check_text_safety(transcribed_text)
+                st.session_state.rag_context = rag_context
                 if not safety_result["flagged"]:
                     st.session_state.dream_text = transcribed_text
                     st.success("안전성 검사: " + safety_result["text"])
                 else:
                     st.error(safety_result["text"])
                     st.session_state.dream_text = ""
-                st.session_state.audio_processed = True
-        finally:
-            if audio_path and os.path.exists(audio_path):
-                os.remove(audio_path)
+            except RuntimeError as e:
+                # 일시적 실패는 캐시되지 않으므로 같은 오디오를 다시 제출하면 재시도됨
+                st.error(f"{e} 같은 오디오를 다시 제출하면 재시도합니다.")
+                st.session_state.dream_text = ""
+            st.session_state.audio_processed = True
         st.rerun()
 
     # 분석 시작 로직
@@ -157,8 +240,10 @@ with col_center:
     if st.session_state.analysis_started and st.session_state.dream_report is None:
         if st.session_state.original_dream_text:
             with st.spinner("RAG가 지식 베이스를 참조하여 리포트를 생성하는 중... 🧠"):
-                report = _report_gen.generate_report_with_rag(st.session_state.original_dream_text)
+                # 오디오 처리 단계에서 미리 검색해 둔 컨텍스트를 재사용 (없으면 서비스가 직접 검색)
+                report, rag_context = _report_gen.generate_report_with_rag(st.session_state.original_dream_text, context=st.session_state.rag_context or None)
                 st.session_state.dream_report = report
+                st.session_state.rag_context = rag_context
                 st.session_state.nightmare_keywords = report.get("keywords", [])
                 st.rerun()
         else:
@@ -197,18 +282,50 @@ with col_center:
         with col1:
             if st.button("😱 악몽 이미지 그대로 보기"):
                 with st.spinner("악몽을 시각화하는 중..."):
-                    prompt = _analyzer.create_nightmare_prompt(st.session_state.original_dream_text, report)
+                    prompt = _analyzer.create_nightmare_prompt(st.session_state.original_dream_text, report, context=st.session_state.rag_context)
                     st.session_state.nightmare_prompt = prompt
                     st.session_state.nightmare_image_url = _img_gen.generate_image_from_prompt(prompt)
                     st.rerun()
         with col2:
             if st.button("✨ 재구성된 꿈 이미지 보기"):
                 with st.spinner("악몽을 긍정적인 꿈으로 재구성하는 중..."):
-                    prompt, summary, mappings = _analyzer.create_reconstructed_prompt_and_analysis(st.session_state.original_dream_text, report)
+                    prompt, summary, mappings = _analyzer.create_reconstructed_prompt_and_analysis(st.session_state.original_dream_text, report, context=st.session_state.rag_context)
                     st.session_state.reconstructed_prompt, st.session_state.transformation_summary, st.session_state.keyword_mappings = prompt, summary, mappings
                     st.session_state.reconstructed_image_url = _img_gen.generate_image_from_prompt(prompt)
                     st.rerun()
 
+        # 두 이미지 동시 생성 버튼 (프롬프트/이미지 API 호출을 병렬로 실행)
+        if st.button("⚡ 두 이미지 모두 생성"):
+            with st.spinner("악몽과 재구성된 꿈을 동시에 시각화하는 중..."):
+                # 세션 값을 스크립트 스레드에서 미리 지역 변수로 복사
+                # (코루틴은 백그라운드 러너 스레드에서 실행되어 ScriptRunContext가 없으므로
+                #  그 안에서 st.session_state에 접근하면 빈 상태를 보게 됨)
+                dream_text = st.session_state.original_dream_text
+                rag_context = st.session_state.rag_context
+
+                # 악몽 파이프라인: 프롬프트 생성 후 이미지 생성 (각 단계는 순차, 파이프라인끼리는 병렬)
+                async def pipeline_nightmare():
+                    prompt = await _analyzer.acreate_nightmare_prompt(dream_text, report, context=rag_context)
+                    image_url = await _img_gen.agenerate_image_from_prompt(prompt)
+                    return prompt, image_url
+
+                # 재구성 파이프라인: 재구성 프롬프트/분석 생성 후 이미지 생성
+                async def pipeline_reconstructed():
+                    prompt, summary, mappings = await _analyzer.acreate_reconstructed_prompt_and_analysis(dream_text, report, context=rag_context)
+                    image_url = await _img_gen.agenerate_image_from_prompt(prompt)
+                    return prompt, summary, mappings, image_url
+
+                # 두 파이프라인을 동시에 실행 → 총 대기 시간이 t1+t2가 아닌 max(t1,t2)로 단축
+                async def run_both():
+                    return await asyncio.gather(pipeline_nightmare(), pipeline_reconstructed())
+
+                (nightmare_prompt, nightmare_url), (recon_prompt, recon_summary, recon_mappings, recon_url) = run_sync(run_both())
+                st.session_state.nightmare_prompt = nightmare_prompt
+                st.session_state.nightmare_image_url = nightmare_url
+                st.session_state.reconstructed_prompt, st.session_state.transformation_summary, st.session_state.keyword_mappings = recon_prompt, recon_summary, recon_mappings
+                st.session_state.reconstructed_image_url = recon_url
+                st.rerun()
+
         # 생성된 이미지 표시
         if st.session_state.nightmare_image_url or st.session_state.reconstructed_image_url:
             st.markdown("---")
@@ -0,0 +1,44 @@
+import atexit # 프로세스 종료 시 백그라운드 루프 정리
+import asyncio # 이벤트 루프 생성 및 코루틴 실행
+import threading # 루프를 상주시킬 데몬 스레드와 생성 경쟁 방지 락
+
+# 프로세스 전역에서 공유하는 백그라운드 이벤트 루프 (지연 생성)
+# httpx.AsyncClient의 keep-alive/HTTP2 커넥션은 생성된 루프에 묶이므로,
+# 호출마다 asyncio.run으로 루프를 새로 만들면 두 번째 호출부터
+# "Event loop is closed" 오류가 난다. 모든 비동기 작업을 이 루프 하나로
+# 보내면 커넥션 풀이 루프 수명 내내 안전하게 재사용된다.
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _shutdown_loop():
+    """프로세스 종료 시 백그라운드 루프를 정지시키는 내부 함수"""
+    if _loop is not None and _loop.is_running():
+        _loop.call_soon_threadsafe(_loop.stop)
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """
+    공유 백그라운드 이벤트 루프를 반환합니다 (첫 호출 시 데몬 스레드에서 기동).
+    :return: 데몬 스레드에서 상주 실행 중인 이벤트 루프
+    """
+    global _loop
+    with _loop_lock: # 멀티스레드 환경에서 루프가 중복 생성되지 않도록 보호
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            # 데몬 스레드라 남은 작업이 있어도 프로세스 종료를 막지 않음
+            threading.Thread(target=loop.run_forever, name="async-runner", daemon=True).start()
+            _loop = loop
+            atexit.register(_shutdown_loop) # 종료 시 루프 정지 등록
+    return _loop
+
+
+def run_sync(coro, timeout: float = None):
+    """
+    코루틴을 공유 백그라운드 루프에서 실행하고 결과를 동기적으로 반환합니다.
+    Streamlit 핸들러처럼 루프 밖의 동기 코드에서 비동기 파이프라인을 돌릴 때 사용합니다.
+    :param coro: 실행할 코루틴
+    :param timeout: (선택 사항) 결과 대기 제한 시간 (초)
+    :return: 코루틴의 반환값 (예외는 호출자에게 그대로 전파)
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result(timeout)
@@ -1,21 +1,114 @@
 import os # 운영체제 기능 제공
+import pickle # 독스토어 매핑 직렬화/역직렬화
+from uuid import uuid4 # 독스토어 문서 id 생성
+import faiss # FAISS 저수준 API (mmap 로드, 양자화 인덱스 등)
+import numpy as np # 임베딩 벡터 배열 처리
+from numba import njit, prange # 벡터 정규화 커널 JIT 컴파일
+from langchain_community.docstore.in_memory import InMemoryDocstore # 인메모리 독스토어
 from langchain_community.document_loaders import (
     DirectoryLoader, # 디렉토리에서 문서 로드
     TextLoader, # 텍스트 파일 로드
 )
 from langchain_community.vectorstores import FAISS # FAISS 벡터 스토어 사용
-from langchain_openai import OpenAIEmbeddings # OpenAI 임베딩 사용
+from langchain_community.embeddings import HuggingFaceEmbeddings # 로컬 임베딩 모델 사용
 from langchain.text_splitter import RecursiveCharacterTextSplitter # 텍스트 재귀 분할
 
+# 검색용 로컬 임베딩 모델: OpenAI API 호출(~120ms) 대비 수십 ms로 임베딩,
+# 384차원이라 인덱스 메모리도 1536차원 대비 1/4 (인제스트와 쿼리에서 동일 모델 사용 필수)
+RETRIEVAL_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+def create_retrieval_embeddings() -> HuggingFaceEmbeddings:
+    """RAG 검색 단계에서 사용할 로컬 임베딩 객체를 생성합니다 (인제스트/쿼리 공용)."""
+    return HuggingFaceEmbeddings(model_name=RETRIEVAL_EMBEDDING_MODEL)
+
+
+def _read_index_mmap(index_path: str):
+    """인덱스 파일을 mmap 우선으로 읽는 내부 함수 (미지원 타입은 일반 로드 폴백)"""
+    try:
+        # 벡터 인덱스를 읽기 전용 mmap으로 로드 (전체 역직렬화 대신 지연 페이지 로드)
+        return faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError:
+        # 인덱스 타입이 mmap 로드를 지원하지 않으면(예: HNSW 그래프) 일반 로드로 폴백
+        return faiss.read_index(index_path)
+
+
+def load_vector_store_mmap(embeddings, index_dir: str = "faiss_index") -> FAISS:
+    """
+    저장된 FAISS 인덱스를 메모리 맵(mmap) 모드로 로드하여 벡터 스토어를 복원합니다.
+
+    FAISS.load_local은 인덱스 전체를 RAM으로 역직렬화하지만,
+    faiss.read_index에 IO_FLAG_MMAP을 주면 벡터 데이터를 페이지 단위로
+    필요할 때만 읽어 콜드 스타트 시간과 상주 메모리를 줄입니다.
+    인덱스 차원이 임베딩 모델과 다르면(모델 교체 후 미재구축) 로컬 임베더로
+    그 자리에서 재구축합니다 — 빌드에 API 키가 필요 없고 data/ 코퍼스가 작기 때문입니다.
+    :param embeddings: 쿼리 임베딩에 사용할 임베딩 객체
+    :param index_dir: 인덱스 파일(index.faiss, index.pkl)이 있는 디렉토리
+    :return: 복원된 LangChain FAISS 벡터 스토어
+    """
+    index_path = os.path.join(index_dir, "index.faiss")
+    index = _read_index_mmap(index_path)
+    # 인덱스 차원과 쿼리 임베딩 차원이 다르면 (예: 임베딩 모델 교체 후 인덱스 미재구축)
+    # 검색 시점의 FAISS 단언 실패 대신 이 자리에서 로컬 임베더로 재구축
+    query_dim = len(embeddings.embed_query("차원 확인용 문장"))
+    if index.d != query_dim:
+        print(f"경고: FAISS 인덱스 차원({index.d})과 임베딩 차원({query_dim})이 달라 "
+              "인덱스를 재구축합니다. 잠시 기다려주세요...")
+        build_vector_store()
+        index = _read_index_mmap(index_path) # 재구축된 인덱스를 다시 로드
+        # 재구축 후에도 차원이 다르면 (data/ 누락 등으로 빌드 실패) 친절한 오류로 표면화
+        if index.d != query_dim:
+            raise ValueError(
+                f"FAISS 인덱스 차원({index.d})과 임베딩 차원({query_dim})이 일치하지 않습니다. "
+                "'python core/indexing_service.py'를 실행하여 인덱스를 다시 생성해주세요."
+            )
+    # HNSW 인덱스인 경우 검색 시 탐색 폭 설정 (재현율/지연시간 균형)
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = 64
+    elif hasattr(faiss, "StandardGpuResources"):
+        # faiss-gpu가 설치되어 있고 GPU 지원 타입(Flat/IVF 계열)이면 GPU로 이동
+        # (검색 커널은 메모리 대역폭 바운드라 GPU HBM에서 10~30배 빠름)
+        # HNSW는 GPU 미지원이라 위 분기에서 CPU에 남음
+        try:
+            index = faiss.index_cpu_to_gpu(faiss.StandardGpuResources(), 0, index)
+        except RuntimeError:
+            pass # GPU 메모리 부족/미지원 타입이면 CPU 인덱스 그대로 사용
+    # save_local이 저장한 독스토어와 id 매핑 로드 (문서 텍스트는 벡터보다 훨씬 작음)
+    with open(os.path.join(index_dir, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    # 로드한 구성 요소로 LangChain FAISS 래퍼를 직접 조립
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=index_to_docstore_id,
+    )
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _l2_normalize_inplace(x):
+    """
+    FP32 벡터 배치를 행 단위로 L2 정규화합니다 (제자리 수정).
+
+    IndexFlatIP 계열에서 내적 = 코사인 유사도가 되려면 단위 벡터가 필요합니다.
+    np.linalg.norm처럼 중간 배열을 할당하지 않고, Numba가 행 루프를
+    멀티코어 SIMD 코드로 컴파일하여 C 수준 속도로 처리합니다.
+    """
+    for i in prange(x.shape[0]): # 행(벡터) 단위 병렬 처리
+        norm = 0.0
+        for j in range(x.shape[1]):
+            norm += x[i, j] * x[i, j]
+        norm = np.sqrt(norm)
+        if norm > 0.0:
+            for j in range(x.shape[1]):
+                x[i, j] /= norm
+
+
 def build_vector_store():
     """
     'data' 디렉토리의 .md 및 .txt 파일을 로드하고,
     텍스트를 분할하여 벡터화한 후 FAISS 벡터 스토어에 저장합니다.
     """
-    # OpenAI API 키 환경변수 확인
-    if not os.getenv("OPENAI_API_KEY"):
-        raise ValueError("OPENAI_API_KEY 환경변수가 설정되지 않았습니다.")
-
+    # 임베딩이 로컬 모델로 수행되므로 인덱스 빌드에 OpenAI API 키는 필요 없음
     print("데이터 로드를 시작합니다...")
     
     try:
@@ -63,18 +156,42 @@ def build_vector_store():
     print("임베딩 및 벡터 스토어 생성을 시작합니다...")
     
     try:
-        # OpenAI 임베딩 모델 초기화
-        embeddings = OpenAIEmbeddings()
+        # 로컬 임베딩 모델 초기화 (검색은 로컬 인코더, 최종 분석 LLM만 OpenAI 사용)
+        embeddings = create_retrieval_embeddings()
+
+        # 문서 텍스트를 배치 임베딩 (FP32 ndarray로 변환)
+        texts = [doc.page_content for doc in docs]
+        vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+        # 내적 = 코사인 유사도가 되도록 문서 벡터를 단위 벡터로 정규화 (Numba 병렬 커널)
+        _l2_normalize_inplace(vectors)
+        d = vectors.shape[1] # 임베딩 차원 수
+
+        # HNSW + FP16 스칼라 양자화 인덱스 생성:
+        # 브루트포스 O(n) 스캔 대신 O(log n) 그래프 탐색, 벡터는 FP16으로 저장
+        index = faiss.IndexHNSWSQ(d, faiss.ScalarQuantizer.QT_fp16, 32, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = 200 # 그래프 구축 품질 (높을수록 재현율↑, 빌드 시간↑)
+        index.train(vectors) # 양자화 파라미터 학습
+        index.add(vectors) # 벡터 추가 및 그래프 구축
 
-        # FAISS 벡터 저장소에 문서와 임베딩 저장
-        db = FAISS.from_documents(docs, embeddings)
+        # LangChain FAISS 래퍼에 필요한 독스토어와 id 매핑 구성
+        ids = [str(uuid4()) for _ in docs]
+        docstore = InMemoryDocstore(dict(zip(ids, docs)))
+        index_to_docstore_id = {i: doc_id for i, doc_id in enumerate(ids)}
+
+        # 양자화된 인덱스로 FAISS 벡터 저장소 조립 및 저장
+        db = FAISS(
+            embedding_function=embeddings,
+            index=index,
+            docstore=docstore,
+            index_to_docstore_id=index_to_docstore_id,
+        )
         db.save_local("faiss_index") # 로컬에 인덱스 저장
     
         print("\n✅ 벡터 스토어 생성이 완료되었습니다. 'faiss_index' 폴더가 생성되었습니다.")
     
     except Exception as e:
         print(f"❌ 임베딩 또는 벡터 스토어 생성 중 오류가 발생했습니다: {e}")
-        print("   OpenAI API 키가 유효한지, 인터넷 연결에 문제가 없는지 확인해주세요.")
+        print("   임베딩 모델 다운로드를 위한 인터넷 연결에 문제가 없는지 확인해주세요.")
 
 # 스크립트 직접 실행 시 build_vector_store 함수 호출
 if __name__ == '__main__':
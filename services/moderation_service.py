@@ -1,17 +1,44 @@
-from openai import OpenAI # OpenAI API와 통신하기 위한 OpenAI 클라이언트 임포트
+from openai import OpenAI, AsyncOpenAI # OpenAI API와 통신하기 위한 동기/비동기 클라이언트 임포트
 
 class ModerationService:
     """
     텍스트 내용의 안전성을 검사하는 서비스를 제공하는 클래스입니다.
     OpenAI의 Moderation API를 사용합니다.
     """
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, http_client=None, http_async_client=None):
         """
         ModerationService를 초기화합니다.
         :param api_key: OpenAI API 키
+        :param http_client: (선택 사항) 서비스 간 공유하는 httpx.Client (커넥션 풀 공유)
+        :param http_async_client: (선택 사항) 서비스 간 공유하는 httpx.AsyncClient
         """
-        # OpenAI 클라이언트 초기화
-        self.client = OpenAI(api_key=api_key)
+        # OpenAI 클라이언트 초기화 (공유 풀이 주어지면 TLS/TCP 핸드셰이크 비용 공유)
+        self.client = OpenAI(api_key=api_key, http_client=http_client)
+        # 비동기 OpenAI 클라이언트 초기화 (다른 API 호출과 동시 실행용)
+        self.aclient = AsyncOpenAI(api_key=api_key, http_client=http_async_client)
+
+    @staticmethod
+    def _build_safety_result(moderation_result) -> dict:
+        """Moderation API 응답 하나를 결과 딕셔너리로 변환하는 내부 함수 (동기/비동기 공용)"""
+        # 텍스트가 안전 정책을 위반했는지 확인
+        if moderation_result.flagged:
+            # 플래그된 카테고리 목록 생성
+            flagged_categories = [
+                cat for cat, flag in moderation_result.categories.model_dump().items() if flag
+            ]
+            # 안전 정책 위반 결과 반환
+            return {
+                "flagged": True,
+                "text": f"입력된 내용이 안전 정책을 위반할 수 있습니다: {', '.join(flagged_categories)}",
+                "details": moderation_result.model_dump()
+            }
+        else:
+            # 안전한 경우 결과 반환
+            return {
+                "flagged": False,
+                "text": "안전합니다.",
+                "details": moderation_result.model_dump()
+            }
 
     def check_text_safety(self, text: str) -> dict:
         """
@@ -19,31 +46,38 @@ class ModerationService:
         :param text: 검사할 텍스트
         :return: flagged (bool), text (str), details (dict)를 포함하는 딕셔너리
         """
+        # 비어 있거나 너무 짧은 입력(무음/잡음 녹음 등)은 API 왕복 없이 통과 처리
+        if not text or len(text.strip()) < 5:
+            return {"flagged": False, "text": "입력이 너무 짧아 검사를 생략했습니다.", "details": {}}
         try:
             # Moderation API를 호출하여 텍스트 안전성 검사
             response = self.client.moderations.create(input=text)
-            # 검사 결과의 첫 번째 요소 가져오기
-            moderation_result = response.results[0]
-            
-            # 텍스트가 안전 정책을 위반했는지 확인
-            if moderation_result.flagged:
-                # 플래그된 카테고리 목록 생성
-                flagged_categories = [
-                    cat for cat, flag in moderation_result.categories.model_dump().items() if flag
-                ]
-                # 안전 정책 위반 결과 반환
-                return {
-                    "flagged": True,
-                    "text": f"입력된 내용이 안전 정책을 위반할 수 있습니다: {', '.join(flagged_categories)}",
-                    "details": moderation_result.model_dump()
-                }
-            else:
-                # 안전한 경우 결과 반환
-                return {
-                    "flagged": False,
-                    "text": "안전합니다.",
-                    "details": moderation_result.model_dump()
-                }
+            # 검사 결과의 첫 번째 요소를 결과 딕셔너리로 변환
+            return self._build_safety_result(response.results[0])
+        except Exception as e:
+            # 오류 발생 시 에러 메시지 출력 및 오류 결과 반환
+            print(f"Error during moderation check: {e}")
+            return {
+                "flagged": True,
+                "text": f"안전성 검사 중 오류가 발생했습니다: {e}",
+                "details": {"error": str(e)}
+            }
+
+    async def acheck_text_safety(self, text: str) -> dict:
+        """
+        check_text_safety의 비동기 버전입니다.
+        RAG 컨텍스트 검색 등 다른 I/O 작업과 동시에 실행할 수 있습니다.
+        :param text: 검사할 텍스트
+        :return: flagged (bool), text (str), details (dict)를 포함하는 딕셔너리
+        """
+        # 비어 있거나 너무 짧은 입력(무음/잡음 녹음 등)은 API 왕복 없이 통과 처리
+        if not text or len(text.strip()) < 5:
+            return {"flagged": False, "text": "입력이 너무 짧아 검사를 생략했습니다.", "details": {}}
+        try:
+            # Moderation API를 비동기로 호출하여 텍스트 안전성 검사
+            response = await self.aclient.moderations.create(input=text)
+            # 검사 결과의 첫 번째 요소를 결과 딕셔너리로 변환
+            return self._build_safety_result(response.results[0])
         except Exception as e:
             # 오류 발생 시 에러 메시지 출력 및 오류 결과 반환
             print(f"Error during moderation check: {e}")
@@ -1,90 +1,597 @@
+import os # FAISS 인덱스 파일의 수정 시각(캐시 무효화 솔트) 확인용 os 모듈 임포트
 import json # JSON 데이터 처리를 위한 json 모듈 임포트
-from typing import List, Any # 타입 힌트를 위한 List, Any 임포트
-from pydantic import BaseModel, Field # Pydantic을 이용한 데이터 모델 정의
+import time # 배치 작업 상태 폴링 간격 제어를 위한 time 모듈 임포트
+import asyncio # 여러 리포트 생성을 동시에 실행하기 위한 asyncio 모듈 임포트
+import hashlib # 꿈 텍스트의 캐시 키(blake2b) 생성을 위한 hashlib 임포트
+import diskcache # 프로세스 재시작에도 유지되는 온디스크 리포트 캐시
+import tiktoken # 묶음 호출의 입력 토큰 예산 계산을 위한 토크나이저
+import numpy as np # LSH 시맨틱 캐시의 임베딩 연산을 위한 numpy 임포트
+from typing import AsyncIterator, List, Any # 타입 힌트를 위한 AsyncIterator, List, Any 임포트
+from pydantic import BaseModel, ConfigDict, Field # Pydantic을 이용한 데이터 모델 정의
+from openai import OpenAI # Batch API 등 저수준 엔드포인트 호출용 클라이언트
 from langchain_core.prompts import ChatPromptTemplate # 챗 프롬프트 템플릿 정의
-from langchain_core.runnables import RunnablePassthrough # 입력값을 그대로 통과시키는 Runnable
 from langchain_openai import ChatOpenAI # OpenAI 챗 모델 사용
 from langchain.output_parsers import PydanticOutputParser # Pydantic 모델 기반 출력 파서
+from core.async_runner import run_sync # 공유 백그라운드 루프에서 코루틴을 동기 실행
+from langchain_core.output_parsers import JsonOutputParser # 스트리밍 부분 파싱을 지원하는 JSON 파서
+
+# RAG 리포트 생성용 프롬프트 템플릿 (동기/배치 경로에서 공용으로 사용)
+# 대화형 경로는 gpt-4o 네이티브 구조화 출력을 사용하므로 형식 지시어를 넣지 않음
+# (호출당 약 200 토큰 절약, 파싱 실패 재시도 제거)
+RAG_PROMPT_TEMPLATE = """
+        You are an AI dream analyst who is an expert in IRT and dream symbolism.
+        Your task is to analyze the user's dream by referring to the provided [Professional Knowledge].
+        Based on BOTH the [User's Dream Text] and the [Professional Knowledge], generate a structured report.
+        The 'analysis_summary' MUST be based on insights from the [Professional Knowledge].
+        All parts of the report (emotions, keywords, summary) MUST be in Korean.
+
+        [Professional Knowledge]
+        {context}
+
+        [User's Dream Text]
+        {dream_text}
+        """
 
 # Pydantic 모델 정의
 # 감정 정보를 담는 모델
 class Emotion(BaseModel):
+    model_config = ConfigDict(frozen=True) # 생성 후 불변 (할당 시 검증 오버헤드 제거)
     emotion: str = Field(description="감정의 명칭 (한국어)") # 감정 명칭
     score: float = Field(description="감정의 강도 (0.0에서 1.0 사이)") # 감정 강도
 
 # 분석 리포트 전체 구조를 담는 모델
 class Report(BaseModel):
+    model_config = ConfigDict(frozen=True) # 생성 후 불변 (할당 시 검증 오버헤드 제거)
     emotions: List[Emotion] = Field(description="주요 감정 목록") # 주요 감정 목록
     keywords: List[str] = Field(description="꿈의 핵심 키워드 목록 (한국어)") # 핵심 키워드 목록
     analysis_summary: str = Field(description="전문 지식을 바탕으로 한 심층 분석 요약 (2-4 문장, 한국어)") # 심층 분석 요약
 
+    @property
+    def emotion_labels(self) -> List[str]:
+        """감정 명칭만 뽑은 리스트 (scores_array와 같은 순서)"""
+        return [emo.emotion for emo in self.emotions]
+
+    @property
+    def scores_array(self) -> np.ndarray:
+        """
+        감정 점수만 연속 FP32 배열로 추출한 SoA 뷰입니다.
+        객체 리스트를 파이썬 루프로 도는 대신 NumPy ufunc(정규화, softmax 등)를
+        바로 적용할 수 있고, float64 대비 메모리도 절반입니다.
+        """
+        return np.fromiter((emo.score for emo in self.emotions), dtype=np.float32, count=len(self.emotions))
+
+    @classmethod
+    def stack_scores(cls, reports: List["Report"]) -> tuple:
+        """
+        여러 리포트의 감정 점수를 고정 감정 어휘에 정렬된 (N, K) FP32 행렬로 적층합니다.
+        수천 건 리포트의 대시보드 집계가 mat.mean(axis=0) 한 번의 벡터 연산이 됩니다.
+        :param reports: 적층할 리포트 목록 (N개)
+        :return: ((N, K) 점수 행렬, K개 감정 명칭 리스트) 튜플. 없는 감정은 0.0입니다.
+        """
+        # 등장 순서를 유지하며 전체 리포트의 감정 어휘 수집
+        labels = list(dict.fromkeys(label for report in reports for label in report.emotion_labels))
+        column = {label: k for k, label in enumerate(labels)}
+        # 리포트별 점수를 해당 감정 열에 채움 (미등장 감정은 0으로 남음)
+        matrix = np.zeros((len(reports), len(labels)), dtype=np.float32)
+        for i, report in enumerate(reports):
+            for emo in report.emotions:
+                matrix[i, column[emo.emotion]] = emo.score
+        return matrix, labels
+
+class SemanticCache:
+    """
+    랜덤 프로젝션 LSH 기반 시맨틱 캐시입니다.
+    꿈 텍스트의 임베딩을 부호 해시(sign hash)로 버킷에 나누고, 같은 버킷 안에서
+    코사인 유사도가 임계값을 넘는 항목이 있으면 캐시된 컨텍스트를 반환합니다.
+    근사-중복 입력에 대해 FAISS 검색(메모리 대역폭 바운드)을 생략할 수 있습니다.
+    """
+    def __init__(self, bits: int = 16, threshold: float = 0.95, seed: int = 0):
+        """
+        :param bits: LSH 해시 비트 수 (버킷 수 = 2^bits)
+        :param threshold: 캐시 적중으로 판정할 코사인 유사도 임계값
+        :param seed: 프로젝션 행렬 생성용 난수 시드 (재현성)
+        """
+        self._bits = bits
+        self._threshold = threshold
+        self._rng = np.random.default_rng(seed)
+        self._projection = None # (d, bits) 가우시안 행렬 (첫 임베딩 차원에 맞춰 지연 생성)
+        self._buckets = {} # 버킷 키 -> [(정규화 벡터, 컨텍스트 문자열)] 목록
+        self._exact = {} # 동일 텍스트 재입력을 위한 정확 일치 빠른 경로
+
+    def _bucket_key(self, vec: np.ndarray) -> bytes:
+        """임베딩 벡터를 부호 해시하여 버킷 키(바이트열)를 생성하는 내부 함수"""
+        # 프로젝션 행렬은 첫 사용 시 임베딩 차원에 맞춰 생성
+        if self._projection is None:
+            self._projection = self._rng.standard_normal((vec.shape[0], self._bits)).astype(np.float32)
+        # sign(v @ R) 비트 패턴이 곧 버킷 키
+        return np.packbits(vec @ self._projection > 0).tobytes()
+
+    def get(self, text: str, vec: np.ndarray):
+        """캐시에서 컨텍스트를 조회합니다. 적중하면 문자열, 아니면 None을 반환합니다."""
+        # 1) 동일 텍스트면 해시/스캔 없이 즉시 반환
+        cached = self._exact.get(text)
+        if cached is not None:
+            return cached
+        # 2) 같은 버킷의 후보들과 코사인 유사도 비교 (벡터는 저장 시 정규화됨)
+        vec = vec / (np.linalg.norm(vec) or 1.0)
+        for stored_vec, context in self._buckets.get(self._bucket_key(vec), []):
+            if float(vec @ stored_vec) > self._threshold:
+                return context
+        return None
+
+    def put(self, text: str, vec: np.ndarray, context: str) -> None:
+        """검색 결과 컨텍스트를 캐시에 저장합니다."""
+        vec = vec / (np.linalg.norm(vec) or 1.0)
+        self._buckets.setdefault(self._bucket_key(vec), []).append((vec, context))
+        self._exact[text] = context
+
+
+# 여러 꿈을 한 번의 호출로 분석할 때의 응답 구조 (입력 순서대로 리포트 배열)
+class ReportBatch(BaseModel):
+    model_config = ConfigDict(frozen=True) # 생성 후 불변 (할당 시 검증 오버헤드 제거)
+    reports: List[Report] = Field(description="입력 꿈과 같은 순서의 리포트 목록") # 순서 보존 리포트 목록
+
+# 여러 꿈을 한 번에 분석하는 묶음 호출용 프롬프트 템플릿
+# (시스템 지시를 K개 항목이 공유하므로 프롬프트 토큰 오버헤드가 K분의 1로 줄어듦)
+GROUPED_PROMPT_TEMPLATE = """
+        You are an AI dream analyst who is an expert in IRT and dream symbolism.
+        Below are {count} dreams, each with its own [Professional Knowledge] section.
+        Analyze EACH dream independently, referring ONLY to its own [Professional Knowledge].
+        Each 'analysis_summary' MUST be based on insights from that dream's [Professional Knowledge].
+        All parts of every report (emotions, keywords, summary) MUST be in Korean.
+        Return exactly one Report per dream, in the same order as the inputs.
+
+        {dreams_block}
+        """
+
+# 모듈 로드 시 pydantic-core 검증기/스키마/파서를 미리 빌드
+# (첫 요청이 스키마 생성 비용(수백 µs~ms)을 부담하지 않도록 임포트 시점으로 이동)
+try:
+    Report.model_validate({"emotions": [], "keywords": [], "analysis_summary": ""})
+except Exception:
+    pass # 목적은 검증기 빌드이므로 검증 결과 자체는 무시
+REPORT_JSON_SCHEMA = Report.model_json_schema()
+# 파서와 형식 지시어도 한 번만 생성하여 서비스 인스턴스들이 공유
+_REPORT_PARSER = PydanticOutputParser(pydantic_object=Report)
+REPORT_FORMAT_INSTRUCTIONS = _REPORT_PARSER.get_format_instructions()
+
+
 class ReportGeneratorService:
     """
     [RAG 통합 버전] 꿈 텍스트와 전문 지식을 함께 분석하여
     감정, 키워드, 심층 분석 요약을 포함하는 리포트를 생성하는 클래스입니다.
     """
-    def __init__(self, api_key: str, retriever: Any = None):
+    def __init__(self, api_key: str, retriever: Any = None, http_client=None, http_async_client=None,
+                 embeddings: Any = None, cache_dir: str = ".report_cache", index_dir: str = "faiss_index"):
         """
         ReportGeneratorService를 초기화합니다.
         :param api_key: OpenAI API 키
         :param retriever: (선택 사항) 미리 학습된 FAISS retriever 객체
+        :param http_client: (선택 사항) 서비스 간 공유하는 httpx.Client (커넥션 풀 공유)
+        :param http_async_client: (선택 사항) 서비스 간 공유하는 httpx.AsyncClient
+        :param embeddings: (선택 사항) 쿼리 임베딩 객체. 주어지면 LSH 시맨틱 캐시로
+                           근사-중복 꿈 텍스트의 FAISS 재검색을 생략합니다.
+        :param cache_dir: 온디스크 리포트 캐시 디렉터리 경로
+        :param index_dir: FAISS 인덱스 디렉터리 경로 (캐시 무효화 솔트 계산용)
         """
-        # OpenAI 챗 모델 초기화
-        self.llm = ChatOpenAI(model="gpt-4o", api_key=api_key, temperature=0.3)
+        # OpenAI 챗 모델 초기화 (공유 httpx 클라이언트로 커넥션 풀 공유 가능)
+        self.llm = ChatOpenAI(model="gpt-4o", api_key=api_key, temperature=0.3,
+                              http_client=http_client, http_async_client=http_async_client)
+        # Batch API(파일 업로드/배치 생성) 호출용 저수준 클라이언트 (httpx 풀 공유)
+        self.client = OpenAI(api_key=api_key, http_client=http_client)
         # 검색기(retriever) 설정 (RAG 사용 시 필요)
         self.retriever = retriever
-        # PydanticOutputParser를 사용하여 리포트 모델에 맞게 출력 파싱
-        self.parser = PydanticOutputParser(pydantic_object=Report)
+        # PydanticOutputParser는 Batch API 출력(자유 텍스트 JSON)의 파싱용으로만 유지
+        # (임포트 시점에 미리 빌드된 모듈 단위 인스턴스/지시어를 그대로 참조)
+        self.parser = _REPORT_PARSER
+        self._format_instructions = REPORT_FORMAT_INSTRUCTIONS
+        self.prompt = ChatPromptTemplate.from_template(RAG_PROMPT_TEMPLATE)
+        # 대화형 경로는 네이티브 JSON 스키마 구조화 출력 사용
+        # (첫 시도에 유효한 JSON 보장 → 파싱 실패 재시도 왕복 제거)
+        self._structured_llm = self.llm.with_structured_output(Report, method="json_schema", strict=True)
+        # LCEL 체인도 여기서 한 번만 조립 (호출마다 파이프 합성 객체를 새로 만들지 않음)
+        self._chain = self.prompt | self._structured_llm
+        # 스트리밍 경로용 체인: JsonOutputParser가 토큰 단위로 부분 딕셔너리를 산출
+        # (네이티브 구조화 출력 대신 형식 지시어를 덧붙인 프롬프트 + JSON 모드 사용)
+        stream_prompt = ChatPromptTemplate.from_template(
+            RAG_PROMPT_TEMPLATE + "\n        {format_instructions}",
+            partial_variables={"format_instructions": self._format_instructions}
+        )
+        self._stream_chain = stream_prompt | self.llm | JsonOutputParser(pydantic_object=Report)
+        # 묶음 호출용 구조화 출력 LLM (ReportBatch 배열 스키마 보장)
+        self._grouped_llm = self.llm.with_structured_output(ReportBatch, method="json_schema", strict=True)
+        # 묶음 크기(K) 산정을 위한 gpt-4o 토크나이저 (o200k_base)
+        self._encoding = tiktoken.encoding_for_model("gpt-4o")
+        # 임베딩 객체가 주어진 경우에만 시맨틱 캐시 활성화
+        self.embeddings = embeddings
+        self._context_cache = SemanticCache() if embeddings is not None else None
+        # 프로세스 재시작 후에도 유지되는 온디스크 리포트 캐시 (SQLite 기반)
+        # 동일 꿈 텍스트 재분석을 수 초의 LLM 왕복에서 마이크로초 단위 조회로 단축
+        self._report_cache = diskcache.Cache(cache_dir)
+        # FAISS 인덱스 파일의 수정 시각을 솔트로 사용 → 인덱스 재구축 시 캐시 자동 무효화
+        try:
+            self._cache_salt = str(os.path.getmtime(os.path.join(index_dir, "index.faiss")))
+        except OSError:
+            self._cache_salt = ""
+        # 동일 텍스트의 동시 요청을 하나로 합치는 single-flight 맵 (키 -> 진행 중 Future)
+        self._inflight = {}
+        # 락은 첫 사용 시점에 실행 중인 루프 위에서 생성 (asyncio.Lock은 처음 사용한
+        # 루프에 묶이므로, __init__이 루프 밖에서 호출되는 경우를 대비한 지연 생성)
+        self._inflight_lock = None
 
     def _format_docs(self, docs: List[Any]) -> str:
-        """검색된 문서들을 하나의 문자열로 결합하는 내부 함수"""
-        return "\n\n".join(doc.page_content for doc in docs)
+        """검색된 문서들을 중복 제거 후 하나의 문자열로 결합하는 내부 함수"""
+        # 리스트로 먼저 구체화 (join이 크기를 미리 알 수 있어 제너레이터보다 빠름)
+        # dict.fromkeys로 순서를 유지하며 동일 내용 문서 중복 제거
+        # (중복 청크는 프롬프트 토큰만 낭비하고 분석 품질에 기여하지 않음)
+        parts = list(dict.fromkeys(doc.page_content for doc in docs))
+        return "\n\n".join(parts)
+
+    def retrieve_context(self, dream_text: str) -> str:
+        """
+        꿈 텍스트와 관련된 전문 지식 컨텍스트를 검색하여 문자열로 반환합니다.
+        :param dream_text: 검색 쿼리로 사용할 꿈 텍스트
+        :return: 검색된 문서들을 결합한 컨텍스트 문자열
+        """
+        # retriever가 없으면 컨텍스트 검색 불가
+        if not self.retriever:
+            raise ValueError("컨텍스트를 검색하려면 retriever 객체가 필요합니다.")
+        # 시맨틱 캐시가 활성화된 경우 근사-중복 텍스트의 재검색을 생략
+        query_vec = None
+        if self._context_cache is not None:
+            query_vec = np.asarray(self.embeddings.embed_query(dream_text), dtype=np.float32)
+            cached = self._context_cache.get(dream_text, query_vec)
+            if cached is not None:
+                return cached
+        # 검색 후 문서들을 하나의 문자열로 결합
+        context = self._format_docs(self.retriever.invoke(dream_text))
+        # 다음 호출을 위해 결과를 캐시에 저장
+        if query_vec is not None:
+            self._context_cache.put(dream_text, query_vec, context)
+        return context
 
-    def generate_report_with_rag(self, dream_text: str) -> dict:
+    async def aretrieve_context(self, dream_text: str) -> str:
+        """
+        retrieve_context의 비동기 버전입니다.
+        안전성 검사 등 다른 API 호출과 동시에 실행하여 대기 시간을 겹칠 수 있습니다.
+        :param dream_text: 검색 쿼리로 사용할 꿈 텍스트
+        :return: 검색된 문서들을 결합한 컨텍스트 문자열
+        """
+        # retriever가 없으면 컨텍스트 검색 불가
+        if not self.retriever:
+            raise ValueError("컨텍스트를 검색하려면 retriever 객체가 필요합니다.")
+        # 시맨틱 캐시가 활성화된 경우 근사-중복 텍스트의 재검색을 생략
+        # (로컬 임베딩은 CPU 연산이므로 to_thread로 이벤트 루프를 막지 않음)
+        query_vec = None
+        if self._context_cache is not None:
+            query_vec = np.asarray(
+                await asyncio.to_thread(self.embeddings.embed_query, dream_text), dtype=np.float32
+            )
+            cached = self._context_cache.get(dream_text, query_vec)
+            if cached is not None:
+                return cached
+        # 비동기 검색 후 문서들을 하나의 문자열로 결합
+        docs = await self.retriever.ainvoke(dream_text)
+        context = self._format_docs(docs)
+        # 다음 호출을 위해 결과를 캐시에 저장
+        if query_vec is not None:
+            self._context_cache.put(dream_text, query_vec, context)
+        return context
+
+    def generate_report_with_rag(self, dream_text: str, context: str = None) -> tuple:
         """
         주어진 꿈 텍스트에 대해 RAG를 활용한 심층 분석 리포트를 생성합니다.
+        검색된 컨텍스트도 함께 반환하여 후속 단계(이미지 프롬프트 생성)가
+        재검색 없이 재사용할 수 있게 합니다.
         :param dream_text: 분석할 꿈의 텍스트
-        :return: 감정, 키워드, 심층 분석 요약을 포함하는 딕셔너리
+        :param context: (선택 사항) 미리 검색해 둔 컨텍스트 문자열. 주어지면 검색 단계를 건너뜁니다.
+        :return: (리포트 딕셔너리, 사용된 컨텍스트 문자열) 튜플
         """
         # retriever가 없으면 RAG 리포트 생성이 불가하므로 에러 발생
-        if not self.retriever:
+        if not self.retriever and context is None:
             raise ValueError("RAG 리포트를 생성하려면 retriever 객체가 필요합니다.")
 
-        # RAG를 위한 프롬프트 템플릿 정의
-        rag_prompt_template = """
-        You are an AI dream analyst who is an expert in IRT and dream symbolism.
-        Your task is to analyze the user's dream by referring to the provided [Professional Knowledge].
-        Based on BOTH the [User's Dream Text] and the [Professional Knowledge], generate a structured report.
-        The 'analysis_summary' MUST be based on insights from the [Professional Knowledge].
-        All parts of the report (emotions, keywords, summary) MUST be in Korean.
-        {format_instructions}
+        # 온디스크 캐시 적중 시 LLM/FAISS를 건너뛰고 즉시 반환 (재시작 후에도 유효)
+        cache_key = self._report_cache_key(dream_text)
+        cached = self._report_cache.get(cache_key)
+        if cached is not None:
+            return cached # (리포트 딕셔너리, 컨텍스트) 튜플이 그대로 저장되어 있음
 
-        [Professional Knowledge]
-        {context}
+        try:
+            # 미리 검색된 컨텍스트가 없으면 이 시점에 검색 수행
+            if context is None:
+                context = self.retrieve_context(dream_text)
+            # __init__에서 조립한 체인 실행 및 리포트 객체 반환
+            report_object = self._chain.invoke({"context": context, "dream_text": dream_text})
+            # 성공한 결과만 캐시에 저장 (오류 리포트는 캐시하지 않음)
+            self._report_cache.set(cache_key, (report_object.model_dump(), context))
+            return report_object.model_dump(), context # 리포트와 사용된 컨텍스트를 함께 반환
+        except Exception as e:
+            # 오류 발생 시 에러 메시지 출력 및 빈 리포트 반환
+            print(f"Error generating report with RAG: {e}")
+            return {"emotions": [], "keywords": [], "analysis_summary": f"RAG 리포트 생성 중 오류가 발생했습니다: {e}"}, (context or "")
 
-        [User's Dream Text]
-        {dream_text}
+    async def agenerate_report_with_rag(self, dream_text: str, context: str = None) -> tuple:
+        """
+        generate_report_with_rag의 비동기 + single-flight 버전입니다.
+        같은 꿈 텍스트에 대한 요청이 이미 진행 중이면 새로 체인을 실행하지 않고
+        그 결과 Future를 함께 기다립니다 (중복 버스트 시 LLM 호출이 절반 이하로 감소).
+        :param dream_text: 분석할 꿈의 텍스트
+        :param context: (선택 사항) 미리 검색해 둔 컨텍스트 문자열
+        :return: (리포트 딕셔너리, 사용된 컨텍스트 문자열) 튜플
+        """
+        # retriever가 없으면 RAG 리포트 생성이 불가하므로 에러 발생
+        if not self.retriever and context is None:
+            raise ValueError("RAG 리포트를 생성하려면 retriever 객체가 필요합니다.")
+
+        # 락을 실행 중인 루프 위에서 지연 생성 (단일 루프이므로 확인-생성 사이 경쟁 없음)
+        if self._inflight_lock is None:
+            self._inflight_lock = asyncio.Lock()
+
+        # 동일 텍스트의 진행 중 요청이 있는지 확인 (딕셔너리 변경은 락으로 보호)
+        key = hashlib.blake2b(dream_text.encode("utf-8"), digest_size=16).hexdigest()
+        async with self._inflight_lock:
+            existing = self._inflight.get(key)
+            if existing is None:
+                # 첫 요청이면 다른 호출자들이 기다릴 Future를 등록
+                future = asyncio.get_running_loop().create_future()
+                self._inflight[key] = future
+        if existing is not None:
+            # 이미 진행 중이면 추가 비용 없이 그 결과를 공유
+            return await existing
+
+        try:
+            try:
+                # 온디스크 캐시 적중 시 체인 실행 생략
+                cached = self._report_cache.get(self._report_cache_key(dream_text))
+                if cached is not None:
+                    result = cached
+                else:
+                    # 미리 검색된 컨텍스트가 없으면 이 시점에 비동기로 검색 수행
+                    if context is None:
+                        context = await self.aretrieve_context(dream_text)
+                    # __init__에서 조립한 체인을 비동기로 실행
+                    report_object = await self._chain.ainvoke({"context": context, "dream_text": dream_text})
+                    result = (report_object.model_dump(), context)
+                    # 성공한 결과만 캐시에 저장 (오류 리포트는 캐시하지 않음)
+                    self._report_cache.set(self._report_cache_key(dream_text), result)
+            except Exception as e:
+                # 오류 발생 시 에러 메시지 출력 및 빈 리포트 반환 (대기 중인 호출자도 동일 결과 수신)
+                print(f"Error generating report with RAG: {e}")
+                result = (self._error_report(f"RAG 리포트 생성 중 오류가 발생했습니다: {e}"), (context or ""))
+            future.set_result(result) # 같은 키를 기다리는 호출자들에게 결과 전달
+            return result
+        except BaseException:
+            # CancelledError 등으로 결과를 만들지 못한 경우 Future를 취소하여
+            # 같은 키를 기다리는 호출자들이 영원히 대기하지 않도록 함
+            if not future.done():
+                future.cancel()
+            raise
+        finally:
+            # 모든 종료 경로에서 진행 중 맵에서 제거 (이후 요청은 캐시 또는 새 실행으로 처리)
+            # 취소 중에도 반드시 실행되도록 await 없는 pop 사용 (단일 루프라 락 불필요)
+            self._inflight.pop(key, None)
+
+    async def astream_report(self, dream_text: str, context: str = None) -> AsyncIterator[dict]:
+        """
+        리포트를 스트리밍으로 생성하며 부분 딕셔너리를 순차적으로 산출합니다.
+        emotions/keywords 배열이 먼저 생성되므로 UI나 로깅이 전체 완료를 기다리지
+        않고 첫 필드부터 소비할 수 있어 체감 지연이 마지막 토큰 시간만큼 줄어듭니다.
+        :param dream_text: 분석할 꿈의 텍스트
+        :param context: (선택 사항) 미리 검색해 둔 컨텍스트 문자열
+        :return: 점점 채워지는 부분 리포트 딕셔너리의 비동기 이터레이터
+                 (마지막 항목이 완성본이며, 스트림 종료 시 Report 스키마로 검증됨)
+        """
+        # retriever가 없으면 RAG 리포트 생성이 불가하므로 에러 발생
+        if not self.retriever and context is None:
+            raise ValueError("RAG 리포트를 생성하려면 retriever 객체가 필요합니다.")
+        # 미리 검색된 컨텍스트가 없으면 이 시점에 비동기로 검색 수행
+        if context is None:
+            context = await self.aretrieve_context(dream_text)
+
+        # JsonOutputParser가 지금까지 수신된 토큰으로 파싱 가능한 부분 딕셔너리를 산출
+        partial = None
+        async for partial in self._stream_chain.astream({"context": context, "dream_text": dream_text}):
+            yield partial
+        # 스트림 종료 후 최종 결과를 Report 스키마로 검증 (불완전/형식 오류 시 예외)
+        Report.model_validate(partial)
+
+    async def agenerate_reports_with_rag(self, dream_texts: List[str], max_concurrency: int = 10) -> List[dict]:
+        """
+        여러 꿈 텍스트의 RAG 리포트를 동시에 생성합니다.
+        retriever 검색과 LLM 호출 모두 I/O 바운드이므로 네트워크 대기를 겹치면
+        설정된 동시성 한도까지 거의 선형으로 처리량이 늘어납니다.
+        :param dream_texts: 분석할 꿈 텍스트 목록
+        :param max_concurrency: 동시에 실행할 최대 요청 수
+        :return: 입력 순서와 동일한 순서의 리포트 딕셔너리 목록
         """
-        # 프롬프트 템플릿 생성 및 형식 지시어 적용
-        prompt = ChatPromptTemplate.from_template(
-            rag_prompt_template,
-            partial_variables={"format_instructions": self.parser.get_format_instructions()}
+        # retriever가 없으면 RAG 리포트 생성이 불가하므로 에러 발생
+        if not self.retriever:
+            raise ValueError("RAG 리포트를 생성하려면 retriever 객체가 필요합니다.")
+        if not dream_texts:
+            return []
+
+        # 모든 텍스트의 컨텍스트 검색을 동시에 실행 (개별 실패는 항목 단위로 격리)
+        contexts = await asyncio.gather(
+            *(self.aretrieve_context(text) for text in dream_texts),
+            return_exceptions=True,
         )
-        # LangChain Expression Language (LCEL) 체인 구성
-        chain = (
-            {"context": self.retriever | self._format_docs, "dream_text": RunnablePassthrough()} # context는 retriever로 문서 검색 후 포맷, dream_text는 그대로 전달
-            | prompt # 프롬프트 적용
-            | self.llm # LLM 호출
-            | self.parser # 파서로 출력 형식 변환
+        # abatch에 전달할 입력 딕셔너리 목록 구성 (검색 실패 항목은 빈 컨텍스트)
+        inputs = [
+            {"context": ctx if isinstance(ctx, str) else "", "dream_text": text}
+            for text, ctx in zip(dream_texts, contexts)
+        ]
+
+        # abatch가 max_concurrency 한도 내에서 LLM 호출을 동시에 실행 (__init__에서 조립한 체인)
+        results = await self._chain.abatch(
+            inputs,
+            config={"max_concurrency": max_concurrency},
+            return_exceptions=True,
         )
+        # 개별 예외는 해당 항목만 오류 리포트로 대체하여 순서 유지
+        reports = []
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"Error generating report in abatch: {result}")
+                reports.append(self._error_report(f"RAG 리포트 생성 중 오류가 발생했습니다: {result}"))
+            else:
+                reports.append(result.model_dump())
+        return reports
+
+    def generate_reports_with_rag(self, dream_texts: List[str], max_concurrency: int = 10) -> List[dict]:
+        """
+        agenerate_reports_with_rag의 동기 래퍼입니다 (기존 동기 호출자용).
+        :param dream_texts: 분석할 꿈 텍스트 목록
+        :param max_concurrency: 동시에 실행할 최대 요청 수
+        :return: 입력 순서와 동일한 순서의 리포트 딕셔너리 목록
+        """
+        # 공유 루프에서 실행 (호출마다 루프를 새로 만들면 공유 비동기 풀의 커넥션이 끊김)
+        return run_sync(self.agenerate_reports_with_rag(dream_texts, max_concurrency=max_concurrency))
+
+    def _run_report_group(self, blocks: List[str]) -> List[dict]:
+        """한 묶음(K개)의 꿈 블록을 단일 gpt-4o 호출로 분석하는 내부 함수"""
+        prompt_text = GROUPED_PROMPT_TEMPLATE.format(count=len(blocks), dreams_block="\n\n".join(blocks))
         try:
-            # 체인 실행 및 리포트 객체 반환
-            report_object = chain.invoke(dream_text)
-            return report_object.dict() # 리포트 객체를 딕셔너리로 변환하여 반환
+            batch: ReportBatch = self._grouped_llm.invoke(prompt_text)
+            reports = [report.model_dump() for report in batch.reports]
         except Exception as e:
-            # 오류 발생 시 에러 메시지 출력 및 빈 리포트 반환
-            print(f"Error generating report with RAG: {e}")
-            return {"emotions": [], "keywords": [], "analysis_summary": f"RAG 리포트 생성 중 오류가 발생했습니다: {e}"}
+            # 묶음 전체 실패는 해당 묶음의 항목들만 오류 리포트로 대체
+            print(f"Error generating grouped reports: {e}")
+            return [self._error_report(f"묶음 리포트 생성 중 오류가 발생했습니다: {e}") for _ in blocks]
+        # 모델이 개수를 어긴 경우에도 입력 개수와 정렬 유지 (부족분은 오류 리포트)
+        while len(reports) < len(blocks):
+            reports.append(self._error_report("묶음 리포트 응답에서 해당 항목이 누락되었습니다."))
+        return reports[:len(blocks)]
+
+    def generate_reports_grouped(self, dream_texts: List[str], max_input_tokens: int = 8000) -> List[dict]:
+        """
+        여러 짧은 꿈 텍스트를 K개씩 한 번의 gpt-4o 호출로 묶어 분석합니다.
+        짧은 입력에서는 호출당 고정 비용(TTFT, 시스템 지시, 왕복)이 지배적이므로,
+        공통 지시를 K개 항목이 나눠 부담하면 꿈당 비용과 지연이 크게 줄어듭니다.
+        :param dream_texts: 분석할 꿈 텍스트 목록
+        :param max_input_tokens: 한 묶음의 입력 토큰 상한 (tiktoken 기준)
+        :return: 입력 순서와 동일한 순서의 리포트 딕셔너리 목록
+        """
+        # retriever가 없으면 RAG 컨텍스트 구성이 불가하므로 에러 발생
+        if not self.retriever:
+            raise ValueError("RAG 리포트를 생성하려면 retriever 객체가 필요합니다.")
+        if not dream_texts:
+            return []
+
+        # 공통 지시 부분의 토큰 수 (묶음마다 한 번씩 부담)
+        header_tokens = len(self._encoding.encode(GROUPED_PROMPT_TEMPLATE))
+        reports = []
+        group, group_tokens = [], header_tokens
+        for i, dream_text in enumerate(dream_texts):
+            # 컨텍스트 검색은 꿈별로 수행하고 섹션 헤더를 붙여 블록 구성
+            context = self.retrieve_context(dream_text)
+            block = (f"[Dream {i + 1}]\n"
+                     f"[Professional Knowledge]\n{context}\n"
+                     f"[User's Dream Text]\n{dream_text}")
+            block_tokens = len(self._encoding.encode(block))
+            # 토큰 예산을 넘기면 지금까지 모은 묶음을 먼저 실행
+            if group and group_tokens + block_tokens > max_input_tokens:
+                reports.extend(self._run_report_group(group))
+                group, group_tokens = [], header_tokens
+            group.append(block)
+            group_tokens += block_tokens
+        # 남은 묶음 실행
+        if group:
+            reports.extend(self._run_report_group(group))
+        return reports
+
+    def _report_cache_key(self, dream_text: str) -> str:
+        """꿈 텍스트와 인덱스 솔트로 온디스크 캐시 키를 생성하는 내부 함수"""
+        # 인덱스 수정 시각 솔트를 함께 해시 → 인덱스 재구축 시 키가 달라져 자동 무효화
+        return hashlib.blake2b((self._cache_salt + dream_text).encode("utf-8"), digest_size=16).hexdigest()
+
+    def _error_report(self, message: str) -> dict:
+        """오류 상황에서 반환할 빈 리포트 딕셔너리를 구성하는 내부 함수"""
+        return {"emotions": [], "keywords": [], "analysis_summary": message}
+
+    def generate_reports_batch(self, dream_texts: List[str], poll_interval: float = 30.0) -> List[dict]:
+        """
+        여러 꿈 텍스트를 OpenAI Batch API로 한 번에 분석하여 리포트 목록을 반환합니다.
+        대화형 호출 대비 비용이 50% 저렴하고(24시간 처리 윈도우), 대량 오프라인
+        분석 작업에서 요청별 왕복 지연에 묶이지 않습니다.
+        :param dream_texts: 분석할 꿈 텍스트 목록
+        :param poll_interval: 배치 상태 확인 간격 (초)
+        :return: 입력 순서와 동일한 순서의 리포트 딕셔너리 목록
+        """
+        # retriever가 없으면 RAG 컨텍스트 구성이 불가하므로 에러 발생
+        if not self.retriever:
+            raise ValueError("RAG 리포트를 생성하려면 retriever 객체가 필요합니다.")
+        if not dream_texts:
+            return []
+
+        # 각 꿈 텍스트에 대해 컨텍스트를 검색하고 JSONL 요청 라인 구성
+        request_lines = []
+        for i, dream_text in enumerate(dream_texts):
+            context = self._format_docs(self.retriever.invoke(dream_text))
+            # 대화형 경로와 동일한 프롬프트를 str.format으로 렌더링
+            # (Batch 경로는 json_object 모드이므로 형식 지시어를 뒤에 덧붙여 스키마 전달)
+            rendered_prompt = RAG_PROMPT_TEMPLATE.format(
+                context=context,
+                dream_text=dream_text,
+            ) + "\n" + self._format_instructions
+            request_lines.append(json.dumps({
+                "custom_id": f"dream-{i}", # 결과를 입력 순서로 되돌리기 위한 식별자
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": "gpt-4o",
+                    "temperature": 0.3,
+                    "seed": 42, # 재현 가능한 배치 결과를 위한 시드 고정
+                    "messages": [{"role": "user", "content": rendered_prompt}],
+                    "response_format": {"type": "json_object"}, # 파서가 읽을 JSON 출력 강제
+                },
+            }, ensure_ascii=False))
+
+        # JSONL 페이로드를 배치 입력 파일로 업로드
+        jsonl_bytes = "\n".join(request_lines).encode("utf-8")
+        input_file = self.client.files.create(
+            file=("dream_reports_batch.jsonl", jsonl_bytes),
+            purpose="batch",
+        )
+        # Batch 작업 생성 (24시간 처리 윈도우 = 50% 할인 경로)
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+
+        # 종료 상태가 될 때까지 폴링
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            time.sleep(poll_interval)
+            batch = self.client.batches.retrieve(batch.id)
+
+        # 정상 완료가 아니면 전체를 오류 리포트로 반환
+        if batch.status != "completed" or not batch.output_file_id:
+            print(f"Error in batch report generation: batch status={batch.status}")
+            return [self._error_report(f"배치 리포트 생성이 실패했습니다 (상태: {batch.status}).")
+                    for _ in dream_texts]
+
+        # 출력 파일을 내려받아 custom_id 기준으로 결과 매핑
+        output_text = self.client.files.content(batch.output_file_id).text
+        results_by_id = {}
+        for line in output_text.splitlines():
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            results_by_id[result.get("custom_id")] = result
+
+        # 입력 순서대로 각 결과를 파싱하여 리포트 목록 구성
+        reports = []
+        for i, _ in enumerate(dream_texts):
+            result = results_by_id.get(f"dream-{i}")
+            try:
+                content = result["response"]["body"]["choices"][0]["message"]["content"]
+                reports.append(self.parser.parse(content).model_dump())
+            except Exception as e:
+                # 개별 항목 실패는 해당 항목만 오류 리포트로 대체
+                print(f"Error parsing batch report result (custom_id=dream-{i}): {e}")
+                reports.append(self._error_report(f"배치 리포트 파싱 중 오류가 발생했습니다: {e}"))
+        return reports
 
     def generate_report(self, dream_text: str) -> dict:
         """ (기존 함수) RAG 없이 LLM만으로 리포트를 생성합니다. """
@@ -1,62 +1,279 @@
 import os # 운영체제와 상호작용하는 기능을 제공하는 os 모듈 임포트
-from openai import OpenAI # OpenAI API와 통신하기 위한 OpenAI 클라이언트 임포트
+import mmap # 디스크 오디오를 복사 없이 매핑하여 업로드하기 위한 mmap 모듈 임포트
+import queue # 로그 레코드를 백그라운드 스레드로 넘기는 큐
+import atexit # 프로세스 종료 시 로그 리스너 정리
+import asyncio # 배치 변환의 동시 실행 제어 (세마포어, gather)
+import logging # 핫패스의 print를 대체하는 표준 로깅 모듈
+import subprocess # 업로드 전 ffmpeg 재인코딩(파이프 입출력)을 위한 subprocess 모듈 임포트
+from logging.handlers import QueueHandler, QueueListener # 논블로킹 로그 방출용 핸들러/리스너
+from typing import IO, List, Union # 경로 또는 파일류 객체를 모두 받기 위한 타입 힌트
+from openai import OpenAI, AsyncOpenAI # OpenAI API와 통신하기 위한 동기/비동기 클라이언트 임포트
 import openai # openai의 특정 오류(AuthenticationError, RateLimitError, APIConnectionError 등)를 처리하기 위해 임포트
-from io import BytesIO # 메모리 내에서 바이너리 데이터를 파일처럼 다룰 수 있게 해주는 BytesIO 임포트
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential # 레이트 리밋 대비 재시도
+from core.async_runner import run_sync # 공유 백그라운드 루프에서 코루틴을 동기 실행
+
+# 모듈 단위 로거: 방출은 큐에 넣는 것뿐이라 동시 변환이 많아도 stdout 잠금 경합이 없음
+# (실제 출력은 백그라운드 스레드의 QueueListener가 담당)
+logger = logging.getLogger(__name__)
+if not logger.handlers:
+    _log_queue = queue.Queue(-1) # 무제한 큐 (put이 블로킹되지 않도록)
+    logger.addHandler(QueueHandler(_log_queue))
+    _log_listener = QueueListener(_log_queue, logging.StreamHandler())
+    _log_listener.start()
+    atexit.register(_log_listener.stop) # 종료 시 큐에 남은 레코드를 비우고 스레드 정리
+
+
+def _resolve_ffmpeg() -> str:
+    """사용할 ffmpeg 실행 파일 경로를 찾는 내부 함수"""
+    try:
+        # imageio-ffmpeg이 번들한 실행 파일 우선 사용 (별도 시스템 설치 불필요)
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        # 번들 실행 파일이 없으면 PATH의 ffmpeg에 의존
+        return "ffmpeg"
+
+
+# 모듈 로드 시 한 번만 확인 (호출마다 실행 파일 탐색 방지)
+_FFMPEG_EXE = _resolve_ffmpeg()
+
 
 class STTService:
     """
     Speech-to-Text (STT) 서비스를 제공하는 클래스입니다.
     오디오 파일을 텍스트로 변환하는 기능을 담당합니다.
     """
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, http_client=None, http_async_client=None):
         """
         STTService를 초기화합니다.
         :param api_key: OpenAI API 키
+        :param http_client: (선택 사항) 서비스 간 공유하는 httpx.Client (커넥션 풀 공유)
+        :param http_async_client: (선택 사항) 서비스 간 공유하는 httpx.AsyncClient
         """
-        # OpenAI 클라이언트 초기화
-        self.client = OpenAI(api_key=api_key)
+        # OpenAI 클라이언트 초기화 (공유 풀이 주어지면 TLS/TCP 핸드셰이크 비용 공유)
+        self.client = OpenAI(api_key=api_key, http_client=http_client)
+        # 비동기 OpenAI 클라이언트 초기화 (후속 검사/검색과의 파이프라인 중첩용)
+        self.aclient = AsyncOpenAI(api_key=api_key, http_client=http_async_client)
 
-    def transcribe_audio(self, audio_path: str) -> str:
+    def transcribe_audio(self, audio_source: Union[str, IO[bytes]], file_name: str = "recording.wav") -> str:
         """
-        주어진 오디오 파일 경로에서 음성을 텍스트로 변환합니다.
-        :param audio_path: 변환할 오디오 파일의 경로
+        주어진 오디오(파일 경로 또는 파일류 객체)에서 음성을 텍스트로 변환합니다.
+        이미 메모리에 있는 오디오는 파일류 객체로 전달하면 디스크를 거치지 않습니다.
+        :param audio_source: 변환할 오디오 파일의 경로, 또는 바이너리 파일류 객체
+        :param file_name: 파일류 객체일 때 Whisper API에 전달할 이름 (형식 추론용)
         :return: 변환된 텍스트
         """
         try:
-            # 오디오 파일을 바이너리 읽기 모드로 열기
-            with open(audio_path, "rb") as audio_file:
-                print(f"DEBUG: STTService - '{audio_path}' 파일로 음성 변환을 시작합니다.")
-                # Whisper 모델을 사용하여 음성을 텍스트로 변환 요청
+            if isinstance(audio_source, str):
+                # 오디오 파일을 바이너리 읽기 모드로 열기
+                with open(audio_source, "rb") as audio_file:
+                    logger.debug(f"'{audio_source}' 파일로 음성 변환을 시작합니다.")
+                    # 파일 전체를 RAM으로 읽는 대신 mmap으로 매핑 (파일 크기와 무관하게 메모리 평탄)
+                    mapped = mmap.mmap(audio_file.fileno(), 0, access=mmap.ACCESS_READ)
+                    try:
+                        # Whisper 모델을 사용하여 음성을 텍스트로 변환 요청
+                        transcript = self.client.audio.transcriptions.create(
+                            model="whisper-1", # 사용할 STT 모델 지정
+                            file=(os.path.basename(audio_source), mapped, "audio/wav"), # 매핑된 오디오 데이터
+                            language="ko" # 한국어 인식을 위해 언어 지정
+                        )
+                    finally:
+                        mapped.close() # 업로드 후 매핑 해제
+            else:
+                # 파일류 객체는 (이름, 객체, MIME 타입) 튜플로 바로 업로드 (디스크 왕복 없음)
+                logger.debug(f"메모리 내 오디오로 음성 변환을 시작합니다. 파일 이름: {file_name}")
+                # 파일 이름에서 MIME 타입 유도 (compress_audio가 만든 Opus/ogg를 WAV로 오표기하지 않도록)
+                mime_type = "audio/ogg" if file_name.endswith(".ogg") else "audio/wav"
                 transcript = self.client.audio.transcriptions.create(
                     model="whisper-1", # 사용할 STT 모델 지정
-                    file=audio_file, # 변환할 오디오 파일
+                    file=(file_name, audio_source, mime_type), # 메모리 내 오디오 데이터
                     language="ko" # 한국어 인식을 위해 언어 지정
                 )
-                print("DEBUG: STTService - 음성 변환 성공.")
-                return transcript.text # 변환된 텍스트 반환
-        
+            logger.debug("음성 변환 성공.")
+            return transcript.text # 변환된 텍스트 반환
+
         except FileNotFoundError:
             # 파일이 없을 경우 오류 처리
-            print(f"ERROR: STTService - 오디오 파일을 찾을 수 없습니다. 경로: {audio_path}")
+            logger.error(f"오디오 파일을 찾을 수 없습니다. 경로: {audio_source}")
             return "오디오 파일을 찾을 수 없습니다."
         
         except openai.AuthenticationError as e:
             # OpenAI API 인증 오류 처리
-            print(f"ERROR: STTService - OpenAI API 인증 오류: {e}")
+            logger.error(f"OpenAI API 인증 오류: {e}")
+            return "오류: OpenAI API 키가 잘못되었거나 유효하지 않습니다. 환경변수를 확인해주세요."
+        except openai.RateLimitError as e:
+            # OpenAI API 사용량 한도 초과 오류 처리
+            logger.error(f"OpenAI API 사용량 한도 초과: {e}")
+            return "오류: API 사용량 한도를 초과했습니다. 잠시 후 다시 시도하거나 플랜을 확인해주세요."
+        except openai.APIConnectionError as e:
+            # OpenAI API 연결 실패 오류 처리
+            logger.error(f"OpenAI API 연결 실패: {e}")
+            return "오류: OpenAI 서버에 연결할 수 없습니다. 인터넷 연결을 확인해주세요."
+        except Exception as e:
+            # 그 외 모든 예외 처리
+            logger.error(f"음성 변환 중 알 수 없는 오류 발생: {e}")
+            return f"음성 변환 중 알 수 없는 오류가 발생했습니다: {e}"
+
+    async def atranscribe_audio(self, audio_source: Union[str, IO[bytes]], file_name: str = "recording.wav") -> str:
+        """
+        transcribe_audio의 비동기 버전입니다.
+        변환이 끝나는 즉시 안전성 검사 등 후속 비동기 작업을 이어 붙일 수 있습니다.
+        :param audio_source: 변환할 오디오 파일의 경로, 또는 바이너리 파일류 객체
+        :param file_name: 파일류 객체일 때 Whisper API에 전달할 이름 (형식 추론용)
+        :return: 변환된 텍스트
+        """
+        try:
+            if isinstance(audio_source, str):
+                # 오디오 파일을 바이너리 읽기 모드로 열기
+                with open(audio_source, "rb") as audio_file:
+                    logger.debug(f"'{audio_source}' 파일로 비동기 음성 변환을 시작합니다.")
+                    # 파일 전체를 RAM으로 읽는 대신 mmap으로 매핑 (파일 크기와 무관하게 메모리 평탄)
+                    mapped = mmap.mmap(audio_file.fileno(), 0, access=mmap.ACCESS_READ)
+                    try:
+                        # Whisper 모델을 사용하여 비동기로 음성을 텍스트로 변환 요청
+                        transcript = await self.aclient.audio.transcriptions.create(
+                            model="whisper-1", # 사용할 STT 모델 지정
+                            file=(os.path.basename(audio_source), mapped, "audio/wav"), # 매핑된 오디오 데이터
+                            language="ko" # 한국어 인식을 위해 언어 지정
+                        )
+                    finally:
+                        mapped.close() # 업로드 후 매핑 해제
+            else:
+                # 파일류 객체는 (이름, 객체, MIME 타입) 튜플로 바로 업로드 (디스크 왕복 없음)
+                logger.debug(f"메모리 내 오디오로 비동기 음성 변환을 시작합니다. 파일 이름: {file_name}")
+                # 파일 이름에서 MIME 타입 유도 (compress_audio가 만든 Opus/ogg를 WAV로 오표기하지 않도록)
+                mime_type = "audio/ogg" if file_name.endswith(".ogg") else "audio/wav"
+                transcript = await self.aclient.audio.transcriptions.create(
+                    model="whisper-1", # 사용할 STT 모델 지정
+                    file=(file_name, audio_source, mime_type), # 메모리 내 오디오 데이터
+                    language="ko" # 한국어 인식을 위해 언어 지정
+                )
+            logger.debug("비동기 음성 변환 성공.")
+            return transcript.text # 변환된 텍스트 반환
+
+        except FileNotFoundError:
+            # 파일이 없을 경우 오류 처리
+            logger.error(f"오디오 파일을 찾을 수 없습니다. 경로: {audio_source}")
+            return "오디오 파일을 찾을 수 없습니다."
+        except openai.AuthenticationError as e:
+            # OpenAI API 인증 오류 처리
+            logger.error(f"OpenAI API 인증 오류: {e}")
             return "오류: OpenAI API 키가 잘못되었거나 유효하지 않습니다. 환경변수를 확인해주세요."
         except openai.RateLimitError as e:
             # OpenAI API 사용량 한도 초과 오류 처리
-            print(f"ERROR: STTService - OpenAI API 사용량 한도 초과: {e}")
+            logger.error(f"OpenAI API 사용량 한도 초과: {e}")
             return "오류: API 사용량 한도를 초과했습니다. 잠시 후 다시 시도하거나 플랜을 확인해주세요."
         except openai.APIConnectionError as e:
             # OpenAI API 연결 실패 오류 처리
-            print(f"ERROR: STTService - OpenAI API 연결 실패: {e}")
+            logger.error(f"OpenAI API 연결 실패: {e}")
             return "오류: OpenAI 서버에 연결할 수 없습니다. 인터넷 연결을 확인해주세요."
         except Exception as e:
             # 그 외 모든 예외 처리
-            print(f"ERROR: STTService - 음성 변환 중 알 수 없는 오류 발생: {e}")
+            logger.error(f"음성 변환 중 알 수 없는 오류 발생: {e}")
             return f"음성 변환 중 알 수 없는 오류가 발생했습니다: {e}"
 
+    @staticmethod
+    def _needs_transcoding(audio_bytes: bytes) -> bool:
+        """WAV 헤더를 검사하여 재인코딩이 필요한지 판단하는 내부 함수"""
+        # 표준 RIFF/WAVE 헤더라면 채널 수(오프셋 22)와 샘플레이트(오프셋 24)를 읽음
+        if len(audio_bytes) >= 28 and audio_bytes[:4] == b"RIFF" and audio_bytes[8:12] == b"WAVE":
+            channels = int.from_bytes(audio_bytes[22:24], "little")
+            sample_rate = int.from_bytes(audio_bytes[24:28], "little")
+            # 이미 Whisper 요구 수준(16kHz 모노 이하)이면 재인코딩 생략
+            return not (channels == 1 and sample_rate <= 16000)
+        # WAV가 아니거나 헤더를 해석할 수 없으면 일단 재인코딩 시도
+        return True
+
+    def compress_audio(self, audio_bytes: bytes) -> tuple:
+        """
+        업로드 전 오디오를 Opus 16kHz 모노 24kbps로 재인코딩하여 크기를 줄입니다.
+        Whisper는 16kHz 모노만 사용하므로 44.1kHz 스테레오 WAV 대비 전송량이
+        10~50배 줄어들며 인식 정확도 손실은 없습니다.
+        :param audio_bytes: 원본 오디오 바이트 데이터
+        :return: (업로드할 바이트, 파일 이름) 튜플. 재인코딩 실패 시 원본을 그대로 반환합니다.
+        """
+        # 이미 충분히 작은 형식이면 ffmpeg 호출 없이 원본 유지
+        if not self._needs_transcoding(audio_bytes):
+            return audio_bytes, "audio.wav"
+        try:
+            # 디스크를 거치지 않도록 stdin/stdout 파이프로 재인코딩
+            process = subprocess.run(
+                [_FFMPEG_EXE, "-i", "pipe:0", # 표준 입력에서 원본 읽기
+                 "-ac", "1", # 모노 다운믹스
+                 "-ar", "16000", # 16kHz 리샘플링 (Whisper 내부 샘플레이트)
+                 "-c:a", "libopus", "-b:a", "24k", # Opus 24kbps 인코딩
+                 "-f", "ogg", "pipe:1"], # ogg 컨테이너로 표준 출력에 쓰기
+                input=audio_bytes, capture_output=True, check=True,
+            )
+            if process.stdout:
+                # 확장자를 .ogg로 전달해야 Whisper가 Opus로 인식함
+                return process.stdout, "audio.ogg"
+        except (OSError, subprocess.CalledProcessError) as e:
+            # ffmpeg 미설치/인코딩 실패 시 원본 업로드로 폴백 (기능 우선)
+            logger.warning(f"오디오 재인코딩 실패, 원본을 업로드합니다: {e}")
+        return audio_bytes, "audio.wav"
+
+    @staticmethod
+    def _read_audio_bytes(path: str) -> bytes:
+        """오디오 파일을 한 번의 블로킹 read로 읽는 내부 함수 (to_thread로 실행됨)"""
+        with open(path, "rb") as audio_file:
+            return audio_file.read()
+
+    async def atranscribe_many(self, sources: List[Union[str, bytes]], max_concurrency: int = 10) -> List[str]:
+        """
+        여러 오디오(경로 또는 바이트)를 동시에 변환합니다.
+        각 호출이 서버 지연에 지배되는 순수 I/O이므로, 처리량은 동시성 수에
+        거의 비례하여 증가합니다 (동시성 10이면 순차 대비 약 10배).
+        :param sources: 오디오 파일 경로 또는 바이트 데이터의 목록
+        :param max_concurrency: 동시에 진행할 최대 요청 수 (레이트 리밋 보호)
+        :return: 입력 순서를 유지한 변환 텍스트(또는 오류 메시지) 목록
+        """
+        # 동시 요청 수를 제한하는 세마포어
+        sem = asyncio.Semaphore(max_concurrency)
+
+        # 레이트 리밋/연결 오류는 지수 백오프로 재시도 (OpenAI 병렬 처리 권장 패턴)
+        @retry(retry=retry_if_exception_type((openai.RateLimitError, openai.APIConnectionError)),
+               wait=wait_exponential(multiplier=1, max=30), stop=stop_after_attempt(6))
+        async def _request(file_arg):
+            return await self.aclient.audio.transcriptions.create(
+                model="whisper-1", # 사용할 STT 모델 지정
+                file=file_arg, # 변환할 오디오
+                language="ko" # 한국어 인식을 위해 언어 지정
+            )
+
+        async def _one(source: Union[str, bytes]) -> str:
+            async with sem: # 세마포어로 동시 실행 수 제한
+                try:
+                    if isinstance(source, (bytes, bytearray)):
+                        # 바이트 데이터는 BytesIO 복사 없이 튜플로 바로 업로드
+                        transcript = await _request(("audio.wav", source, "audio/wav"))
+                    else:
+                        # 경로는 스레드로 오프로드하여 읽기 (블로킹 read 시스콜이 이벤트
+                        # 루프를 막지 않으므로 디스크 읽기와 다른 항목의 TLS 업로드가 겹침)
+                        data = await asyncio.to_thread(self._read_audio_bytes, source)
+                        transcript = await _request((os.path.basename(source), data, "audio/wav"))
+                    return transcript.text
+                except FileNotFoundError:
+                    logger.error(f"오디오 파일을 찾을 수 없습니다. 경로: {source}")
+                    return "오디오 파일을 찾을 수 없습니다."
+                except Exception as e:
+                    # 한 항목의 실패가 배치 전체를 중단시키지 않도록 항목별 오류 메시지 반환
+                    logger.error(f"배치 음성 변환 중 오류 발생: {e}")
+                    return f"음성 변환 중 알 수 없는 오류가 발생했습니다: {e}"
+
+        # 모든 항목을 동시에 변환하고 입력 순서대로 결과 수집
+        return list(await asyncio.gather(*[_one(source) for source in sources]))
+
+    def transcribe_many(self, sources: List[Union[str, bytes]], max_concurrency: int = 10) -> List[str]:
+        """
+        atranscribe_many의 동기 래퍼입니다. 이벤트 루프 밖의 호출자용.
+        :param sources: 오디오 파일 경로 또는 바이트 데이터의 목록
+        :param max_concurrency: 동시에 진행할 최대 요청 수
+        :return: 입력 순서를 유지한 변환 텍스트(또는 오류 메시지) 목록
+        """
+        # 공유 루프에서 실행 (호출마다 루프를 새로 만들면 공유 비동기 풀의 커넥션이 끊김)
+        return run_sync(self.atranscribe_many(sources, max_concurrency=max_concurrency))
+
     def transcribe_from_bytes(self, audio_bytes: bytes, file_name: str = "audio.wav") -> str:
         """
         오디오 바이트 데이터에서 음성을 텍스트로 변환합니다.
@@ -66,34 +283,35 @@ class STTService:
         :return: 변환된 텍스트
         """
         try:
-            # BytesIO를 사용하여 바이트 데이터를 파일 객체처럼 생성
-            audio_file_like = BytesIO(audio_bytes)
-            # OpenAI API가 파일 이름을 요구하므로 임시 파일 이름 설정
-            audio_file_like.name = file_name
-
-            print(f"DEBUG: STTService - 바이트 데이터로 음성 변환을 시작합니다. 파일 이름: {file_name}")
-            # Whisper 모델을 사용하여 바이트 데이터로부터 음성을 텍스트로 변환 요청
+            logger.debug(f"바이트 데이터로 음성 변환을 시작합니다. 파일 이름: {file_name}")
+            # 업로드 전 Opus 16kHz 모노로 재인코딩하여 전송량을 줄임 (실패 시 원본 유지)
+            upload_bytes, upload_name = self.compress_audio(audio_bytes)
+            if upload_name == "audio.wav":
+                upload_name = file_name # 재인코딩이 생략된 경우 호출자가 준 이름 유지
+            mime_type = "audio/ogg" if upload_name.endswith(".ogg") else "audio/wav"
+            # BytesIO 복사 없이 (이름, 바이트, MIME 타입) 튜플로 바로 업로드
+            # (큰 녹음 파일에서도 피크 메모리가 원본 한 벌로 유지됨)
             transcript = self.client.audio.transcriptions.create(
                 model="whisper-1", # 사용할 STT 모델 지정
-                file=audio_file_like, # 변환할 바이트 데이터 (파일 객체처럼)
+                file=(upload_name, upload_bytes, mime_type), # 변환할 바이트 데이터
                 language="ko" # 한국어 인식을 위해 언어 지정
             )
-            print("DEBUG: STTService - 바이트 데이터 음성 변환 성공.")
+            logger.debug("바이트 데이터 음성 변환 성공.")
             return transcript.text # 변환된 텍스트 반환
 
         except openai.AuthenticationError as e:
             # OpenAI API 인증 오류 처리
-            print(f"ERROR: STTService - OpenAI API 인증 오류: {e}")
+            logger.error(f"OpenAI API 인증 오류: {e}")
             return "오류: OpenAI API 키가 잘못되었거나 유효하지 않습니다. 환경변수를 확인해주세요."
         except openai.RateLimitError as e:
             # OpenAI API 사용량 한도 초과 오류 처리
-            print(f"ERROR: STTService - OpenAI API 사용량 한도 초과: {e}")
+            logger.error(f"OpenAI API 사용량 한도 초과: {e}")
             return "오류: API 사용량 한도를 초과했습니다. 잠시 후 다시 시도하거나 플랜을 확인해주세요."
         except openai.APIConnectionError as e:
             # OpenAI API 연결 실패 오류 처리
-            print(f"ERROR: STTService - OpenAI API 연결 실패: {e}")
+            logger.error(f"OpenAI API 연결 실패: {e}")
             return "오류: OpenAI 서버에 연결할 수 없습니다. 인터넷 연결을 확인해주세요."
         except Exception as e:
             # 그 외 모든 예외 처리
-            print(f"ERROR: STTService - 바이트 데이터 음성 변환 중 알 수 없는 오류 발생: {e}")
+            logger.error(f"바이트 데이터 음성 변환 중 알 수 없는 오류 발생: {e}")
             return f"오류: 바이트 데이터 음성 변환 중 알 수 없는 오류가 발생했습니다: {e}"
\ No newline at end of file